@@ -1,28 +1,120 @@
+import matplotlib
+matplotlib.use('Agg')  # Use a non-GUI backend for rendering
+matplotlib.rcParams['figure.max_open_warning'] = 0
+
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sklearn.cluster import KMeans
-from sklearn.impute import SimpleImputer
+from numba import njit, prange
 import mysql.connector
+from data_cache import load_table
 from typing import Dict, List, Tuple
 import warnings
 warnings.filterwarnings('ignore')
 
+# Resolution for saved plots
+PLOT_DPI = 80
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _simulate_growth(base: np.ndarray, low: float, high: float, num_samples: int) -> np.ndarray:
+    """Draw Monte Carlo budget paths, scaling each category by a uniform factor in [low, high)."""
+    out = np.empty((num_samples, base.size))
+    for s in prange(num_samples):
+        for c in range(base.size):
+            out[s, c] = base[c] * (low + (high - low) * np.random.random())
+    return out
+
+
+@njit(cache=True)
+def _kmeans(X: np.ndarray, n_clusters: int, n_init: int, seed: int, max_iter: int = 300) -> np.ndarray:
+    """Lloyd's algorithm from k-means++ seeds; returns the labels of the lowest-inertia run."""
+    np.random.seed(seed)
+    n_samples = X.shape[0]
+    best_labels = np.zeros(n_samples, dtype=np.int64)
+    best_inertia = np.inf
+    for _ in range(n_init):
+        # k-means++ seeding: each new center is drawn with probability proportional to D^2
+        centers = np.empty((n_clusters, X.shape[1]))
+        centers[0] = X[np.random.randint(n_samples)]
+        dist = ((X - centers[0]) ** 2).sum(axis=1)
+        for k in range(1, n_clusters):
+            total = dist.sum()
+            if total > 0:
+                idx = min(np.searchsorted(np.cumsum(dist), np.random.random() * total), n_samples - 1)
+            else:
+                idx = np.random.randint(n_samples)
+            centers[k] = X[idx]
+            dist = np.minimum(dist, ((X - centers[k]) ** 2).sum(axis=1))
+
+        # Alternate assignment and center updates until no label changes
+        labels = np.full(n_samples, -1, dtype=np.int64)
+        inertia = 0.0
+        for _ in range(max_iter):
+            changed = False
+            inertia = 0.0
+            for i in range(n_samples):
+                nearest, nearest_dist = 0, np.inf
+                for k in range(n_clusters):
+                    d = ((X[i] - centers[k]) ** 2).sum()
+                    if d < nearest_dist:
+                        nearest, nearest_dist = k, d
+                if labels[i] != nearest:
+                    labels[i] = nearest
+                    changed = True
+                inertia += nearest_dist
+            if not changed:
+                break
+            sums = np.zeros_like(centers)
+            counts = np.zeros(n_clusters)
+            for i in range(n_samples):
+                sums[labels[i]] += X[i]
+                counts[labels[i]] += 1
+            for k in range(n_clusters):
+                if counts[k] > 0:
+                    centers[k] = sums[k] / counts[k]
+        if inertia < best_inertia:
+            best_inertia = inertia
+            best_labels = labels.copy()
+    return best_labels
+
 
 class AdvancedBudgetAnalyzer:
     def __init__(self, db_config: Dict[str, str], table_name: str):
         """Initialize with database configuration and table name."""
         self.db_config = db_config
         self.table_name = table_name
+        self._figure, self._axes = None, None
         self.df = self.load_data_from_db()
         self.prepare_data()
 
+    @property
+    def df(self) -> pd.DataFrame:
+        return self._df
+
+    @df.setter
+    def df(self, value: pd.DataFrame):
+        """Replace the dataset and drop any results computed from the previous one."""
+        self._df = value
+        self._results = {}
+
     def load_data_from_db(self) -> pd.DataFrame:
-        """Load data from SQL database."""
+        """Load data from SQL database, reusing the local Parquet cache when the table is unchanged."""
         conn = mysql.connector.connect(**self.db_config)
-        query = f"SELECT * FROM {self.table_name}"
-        df = pd.read_sql(query, conn)
+        query = f"""
+        SELECT 
+            Cabinet, 
+            Dept, 
+            Program, 
+            ExpenseCategory, 
+            FY22ActualExpense, 
+            FY23ActualExpense, 
+            FY24Appropriation, 
+            FY25Budget 
+        FROM {self.table_name}
+        """
+        df = load_table(conn, self.table_name, query)
         conn.close()
         return df
 
@@ -32,43 +124,72 @@ class AdvancedBudgetAnalyzer:
                            'FY24Appropriation', 'FY25Budget']
         for col in expense_columns:
             self.df[col] = pd.to_numeric(self.df[col], errors='coerce')
+        # Dictionary-encode the grouping keys once
+        for col in ['Cabinet', 'Dept', 'Program', 'ExpenseCategory']:
+            self.df[col] = self.df[col].astype('category')
+
+    def fetch_dept_totals(self) -> pd.DataFrame:
+        """Sum the expense columns per Cabinet and Dept in the database; a NULL Cabinet keeps its own group."""
+        if 'dept_totals' in self._results:
+            return self._results['dept_totals']
+        conn = mysql.connector.connect(**self.db_config)
+        query = f"""
+        SELECT 
+            Cabinet, 
+            Dept, 
+            COALESCE(SUM(FY22ActualExpense), 0) AS FY22ActualExpense, 
+            COALESCE(SUM(FY23ActualExpense), 0) AS FY23ActualExpense, 
+            COALESCE(SUM(FY24Appropriation), 0) AS FY24Appropriation, 
+            COALESCE(SUM(FY25Budget), 0) AS FY25Budget 
+        FROM {self.table_name}
+        WHERE Dept IS NOT NULL
+        GROUP BY Cabinet, Dept
+        ORDER BY Cabinet, Dept
+        """
+        totals = load_table(conn, self.table_name, query)
+        conn.close()
+        for col in ['FY22ActualExpense', 'FY23ActualExpense', 'FY24Appropriation', 'FY25Budget']:
+            totals[col] = pd.to_numeric(totals[col], errors='coerce')
+        totals = totals.set_index(['Cabinet', 'Dept'])
+        self._results['dept_totals'] = totals
+        return totals
 
     def analyze_expense_efficiency(self) -> pd.DataFrame:
-        """Analyze expense efficiency."""
-        efficiency_df = self.df.groupby(['Cabinet', 'Dept']).agg({
-            'FY22ActualExpense': 'sum',
-            'FY23ActualExpense': 'sum',
-            'FY24Appropriation': 'sum',
-            'FY25Budget': 'sum'
-        }).round(2)
+        """Analyze expense efficiency from department totals aggregated by the database."""
+        if 'efficiency' in self._results:
+            return self._results['efficiency']
+        totals = self.fetch_dept_totals()
+        # Like groupby(['Cabinet', 'Dept']), leave out departments without a Cabinet
+        efficiency_df = totals[totals.index.get_level_values('Cabinet').notna()].round(2)
         efficiency_df['FY23_Efficiency'] = (efficiency_df['FY23ActualExpense'] /
                                             efficiency_df['FY24Appropriation'] * 100)
-        efficiency_df['Spending_Pattern'] = pd.cut(
-            efficiency_df['FY23_Efficiency'],
-            bins=[0, 85, 95, 105, float('inf')],
-            labels=['Under Spender', 'Efficient', 'Slight Overspend', 'Major Overspend']
+        # Bins (0, 85], (85, 95], (95, 105], (105, inf]; scores outside them stay missing
+        efficiency = efficiency_df['FY23_Efficiency'].to_numpy(dtype=np.float64)
+        codes = np.searchsorted(np.array([85.0, 95.0, 105.0]), efficiency, side='left')
+        codes[~(efficiency > 0)] = -1
+        efficiency_df['Spending_Pattern'] = pd.Categorical.from_codes(
+            codes,
+            categories=['Under Spender', 'Efficient', 'Slight Overspend', 'Major Overspend'],
+            ordered=True
         )
+        self._results['efficiency'] = efficiency_df
         return efficiency_df
 
     def identify_optimization_clusters(self) -> Tuple[pd.DataFrame, Dict[str, List[str]]]:
         """Identify optimization clusters using K-means clustering."""
-        cluster_data = self.df.groupby('Dept').agg({
-            'FY22ActualExpense': 'sum',
-            'FY23ActualExpense': 'sum',
-            'FY24Appropriation': 'sum',
-            'FY25Budget': 'sum'
-        })
+        if 'clusters' in self._results:
+            return self._results['clusters']
+        cluster_data = self.fetch_dept_totals().groupby(level='Dept').sum()
         cluster_data['Growth_Rate'] = ((cluster_data['FY25Budget'] - 
                                        cluster_data['FY22ActualExpense']) / 
                                       cluster_data['FY22ActualExpense'] * 100).replace([np.inf, -np.inf], np.nan)
         cluster_data['Budget_Size'] = cluster_data['FY25Budget']
-        X = cluster_data[['Growth_Rate', 'Budget_Size']].copy()
-        X.replace([np.inf, -np.inf], np.nan, inplace=True)
-        imputer = SimpleImputer(strategy='mean')
-        X_imputed = imputer.fit_transform(X)
+        X = cluster_data[['Growth_Rate', 'Budget_Size']].to_numpy(dtype=np.float64)
+        X[np.isinf(X)] = np.nan
+        # Impute missing values with the column mean
+        X_imputed = np.where(np.isnan(X), np.nanmean(X, axis=0), X)
         X_imputed = np.clip(X_imputed, -1e6, 1e6)
-        kmeans = KMeans(n_clusters=4, random_state=42)
-        cluster_data['Cluster'] = kmeans.fit_predict(X_imputed)
+        cluster_data['Cluster'] = _kmeans(X_imputed, 4, 10, 42)
         recommendations = {}
         for cluster in range(4):
             cluster_deps = cluster_data[cluster_data['Cluster'] == cluster]
@@ -82,15 +203,20 @@ class AdvancedBudgetAnalyzer:
             if avg_budget > cluster_data['Budget_Size'].mean():
                 recs.append("Large budget allocation. Explore efficiency opportunities.")
             recommendations[f'Cluster_{cluster}'] = recs
+        self._results['clusters'] = (cluster_data, recommendations)
         return cluster_data, recommendations
 
-    def simulate_budget_scenarios(self, num_scenarios: int = 3) -> pd.DataFrame:
+    def simulate_budget_scenarios(self, num_scenarios: int = 3, num_samples: int = 1000) -> pd.DataFrame:
         """Simulate different budget scenarios based on historical patterns and external factors."""
+        if ('scenarios', num_scenarios, num_samples) in self._results:
+            return self._results[('scenarios', num_scenarios, num_samples)]
         scenarios = []
-        base_budget = self.df.groupby('ExpenseCategory')['FY25Budget'].sum()
+        base_budget = self.df.groupby('ExpenseCategory', observed=True)['FY25Budget'].sum()
         
-        # Scenario 1: Conservative Growth
-        conservative = base_budget * np.random.uniform(0.98, 1.02, len(base_budget))
+        # Scenario 1: Conservative Growth (median of the Monte Carlo paths)
+        samples = _simulate_growth(base_budget.to_numpy(dtype=np.float64), 0.98, 1.02, num_samples)
+        p5, p50, p95 = np.percentile(samples, [5, 50, 95], axis=0)
+        conservative = pd.Series(p50, index=base_budget.index)
         scenarios.append(('Conservative', conservative))
         
         # Scenario 2: Aggressive Optimization
@@ -119,54 +245,89 @@ class AdvancedBudgetAnalyzer:
         scenario_df = pd.DataFrame({name: data for name, data in scenarios})
         scenario_df['Current'] = base_budget
         scenario_df['Max_Savings'] = scenario_df[['Conservative', 'Aggressive', 'Strategic']].min(axis=1)
+        scenario_df['Conservative_P5'] = p5
+        scenario_df['Conservative_P95'] = p95
         
+        self._results[('scenarios', num_scenarios, num_samples)] = scenario_df
         return scenario_df
 
-    def plot_efficiency_distribution(self):
+    def expense_category_correlations(self) -> pd.DataFrame:
+        """Correlate department FY25 budgets across expense categories."""
+        if 'correlations' in self._results:
+            return self._results['correlations']
+        # Dense Dept x ExpenseCategory budget matrix built from integer codes
+        dept_codes, depts = pd.factorize(self.df['Dept'], sort=True)
+        category_codes, categories = pd.factorize(self.df['ExpenseCategory'], sort=True)
+        budgets = np.nan_to_num(self.df['FY25Budget'].to_numpy(dtype=np.float64))
+        valid = (dept_codes >= 0) & (category_codes >= 0)
+        budget_matrix = np.zeros((len(depts), len(categories)))
+        np.add.at(budget_matrix, (dept_codes[valid], category_codes[valid]), budgets[valid])
+        correlations = pd.DataFrame(np.corrcoef(budget_matrix, rowvar=False),
+                                    index=np.asarray(categories), columns=np.asarray(categories))
+        self._results['correlations'] = correlations
+        return correlations
+
+    def _plot_axes(self):
+        """Return the shared figure with a cleared axes to draw the next plot on."""
+        if self._figure is None:
+            self._figure, self._axes = plt.subplots(figsize=(10, 6), constrained_layout=True)
+        # Drop extra axes, such as a heatmap colorbar, left by the previous plot
+        for extra in self._figure.axes:
+            if extra is not self._axes:
+                extra.remove()
+        self._axes.clear()
+        # clear() keeps spine visibility, which the heatmap turns off
+        for spine in self._axes.spines.values():
+            spine.set_visible(True)
+        return self._figure, self._axes
+
+    def close_plots(self):
+        """Release the shared figure."""
+        if self._figure is not None:
+            plt.close(self._figure)
+            self._figure, self._axes = None, None
+
+    def plot_efficiency_distribution(self, efficiency_scores: pd.DataFrame = None):
         """Plot the distribution of efficiency scores and save as an image."""
-        efficiency_scores = self.analyze_expense_efficiency()
-        plt.figure(figsize=(10, 6))
-        sns.histplot(data=efficiency_scores['FY23_Efficiency'], bins=20)
-        plt.title('Distribution of Department Efficiency Scores')
-        plt.xlabel('Efficiency Score (Lower is Better)')
-        plt.ylabel('Frequency')
-        plt.tight_layout()
-        plt.savefig('efficiency_distribution.png')
-        plt.close()
-
-    def plot_budget_scenarios_comparison(self):
+        if efficiency_scores is None:
+            efficiency_scores = self.analyze_expense_efficiency()
+        fig, ax = self._plot_axes()
+        sns.histplot(data=efficiency_scores['FY23_Efficiency'], bins=20, ax=ax)
+        ax.set_title('Distribution of Department Efficiency Scores')
+        ax.set_xlabel('Efficiency Score (Lower is Better)')
+        ax.set_ylabel('Frequency')
+        fig.savefig('efficiency_distribution.png', dpi=PLOT_DPI)
+
+    def plot_budget_scenarios_comparison(self, scenarios: pd.DataFrame = None):
         """Plot budget scenarios comparison and save as an image."""
-        scenarios = self.simulate_budget_scenarios()
-        plt.figure(figsize=(10, 6))
-        scenarios.plot(kind='bar', rot=45)
-        plt.title('Budget Scenarios Comparison')
-        plt.xlabel('Expense Category')
-        plt.ylabel('Budget Amount')
-        plt.tight_layout()
-        plt.savefig('budget_scenarios_comparison.png')
-        plt.close()
-
-    def plot_department_clusters(self):
+        if scenarios is None:
+            scenarios = self.simulate_budget_scenarios()
+        fig, ax = self._plot_axes()
+        scenarios.drop(columns=['Conservative_P5', 'Conservative_P95']).plot(kind='bar', rot=45, ax=ax)
+        ax.set_title('Budget Scenarios Comparison')
+        ax.set_xlabel('Expense Category')
+        ax.set_ylabel('Budget Amount')
+        fig.savefig('budget_scenarios_comparison.png', dpi=PLOT_DPI)
+
+    def plot_department_clusters(self, cluster_data: pd.DataFrame = None):
         """Plot department clusters by growth and budget and save as an image."""
-        cluster_data, _ = self.identify_optimization_clusters()
-        plt.figure(figsize=(10, 6))
-        sns.scatterplot(data=cluster_data, x='Growth_Rate', y='Budget_Size', hue='Cluster', palette='deep')
-        plt.title('Department Clusters by Growth and Budget')
-        plt.xlabel('Growth Rate')
-        plt.ylabel('Budget Size')
-        plt.tight_layout()
-        plt.savefig('department_clusters.png')
-        plt.close()
-
-    def plot_expense_category_correlations(self):
+        if cluster_data is None:
+            cluster_data, _ = self.identify_optimization_clusters()
+        fig, ax = self._plot_axes()
+        sns.scatterplot(data=cluster_data, x='Growth_Rate', y='Budget_Size', hue='Cluster', palette='deep', ax=ax)
+        ax.set_title('Department Clusters by Growth and Budget')
+        ax.set_xlabel('Growth Rate')
+        ax.set_ylabel('Budget Size')
+        fig.savefig('department_clusters.png', dpi=PLOT_DPI)
+
+    def plot_expense_category_correlations(self, correlations: pd.DataFrame = None):
         """Plot expense category correlations and save as an image."""
-        pivot_df = self.df.pivot_table(index='Dept', columns='ExpenseCategory', values='FY25Budget', aggfunc='sum').fillna(0)
-        plt.figure(figsize=(10, 6))
-        sns.heatmap(pivot_df.corr(), annot=True, cmap='coolwarm', center=0)
-        plt.title('Expense Category Correlations')
-        plt.tight_layout()
-        plt.savefig('expense_category_correlations.png')
-        plt.close()
+        if correlations is None:
+            correlations = self.expense_category_correlations()
+        fig, ax = self._plot_axes()
+        sns.heatmap(correlations, annot=True, cmap='coolwarm', center=0, ax=ax)
+        ax.set_title('Expense Category Correlations')
+        fig.savefig('expense_category_correlations.png', dpi=PLOT_DPI)
 
 # Example usage
 if __name__ == "__main__":
@@ -177,15 +338,20 @@ if __name__ == "__main__":
         'database': 'citybudget'
     }
     analyzer = AdvancedBudgetAnalyzer(db_config, 'BudgetData')
-    print("Department Efficiency Analysis:")
-    print(analyzer.analyze_expense_efficiency().head())
+    # Compute each analysis once and reuse it for printing and plotting
+    efficiency_scores = analyzer.analyze_expense_efficiency()
     cluster_data, recommendations = analyzer.identify_optimization_clusters()
+    scenarios = analyzer.simulate_budget_scenarios()
+    correlations = analyzer.expense_category_correlations()
+    print("Department Efficiency Analysis:")
+    print(efficiency_scores.head())
     print("\nCluster Recommendations:")
     for cluster, recs in recommendations.items():
         print(f"\n{cluster}:")
         for rec in recs:
             print(f"- {rec}")
-    analyzer.plot_efficiency_distribution()
-    analyzer.plot_budget_scenarios_comparison()
-    analyzer.plot_department_clusters()
-    analyzer.plot_expense_category_correlations()
\ No newline at end of file
+    analyzer.plot_efficiency_distribution(efficiency_scores)
+    analyzer.plot_budget_scenarios_comparison(scenarios)
+    analyzer.plot_department_clusters(cluster_data)
+    analyzer.plot_expense_category_correlations(correlations)
+    analyzer.close_plots()
@@ -1,4 +1,5 @@
 import mysql.connector
+from data_cache import load_table
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -16,7 +17,7 @@ class BudgetAnalyzer:
         self.prepare_data()
 
     def fetch_data(self) -> pd.DataFrame:
-        """Fetch data from the BudgetData table in the SQL database."""
+        """Fetch data from the BudgetData table, reusing the local Parquet cache when the table is unchanged."""
         query = """
         SELECT 
             Cabinet, 
@@ -29,7 +30,7 @@ class BudgetAnalyzer:
             FY25Budget 
         FROM BudgetData
         """
-        return pd.read_sql(query, self.connection)
+        return load_table(self.connection, 'BudgetData', query)
 
     def prepare_data(self):
         """Prepare and clean the dataset for analysis."""
@@ -40,11 +41,15 @@ class BudgetAnalyzer:
         for col in expense_columns:
             if col in self.df.columns:
                 self.df[col] = pd.to_numeric(self.df[col], errors='coerce')
+        # Dictionary-encode the grouping keys once
+        for col in ['Cabinet', 'Dept', 'Program', 'ExpenseCategory']:
+            if col in self.df.columns:
+                self.df[col] = self.df[col].astype('category')
 
     def plot_fy25_budget_by_expense_category(self):
         """Plot FY25 Budget by Expense Category."""
         plt.figure(figsize=(10, 6))
-        expense_trends = self.df.groupby('ExpenseCategory')['FY25Budget'].sum().sort_values(ascending=True)
+        expense_trends = self.df.groupby('ExpenseCategory', observed=True)['FY25Budget'].sum().sort_values(ascending=True)
         expense_trends.plot(kind='barh', color='skyblue')
         plt.title('FY25 Budget by Expense Category', fontsize=14)
         plt.xlabel('Budget Amount ($)', fontsize=12)
@@ -54,7 +59,7 @@ class BudgetAnalyzer:
     def plot_budget_trends_by_cabinet(self):
         """Plot Budget Trends by Cabinet."""
         plt.figure(figsize=(12, 6))
-        cabinet_years = self.df.groupby('Cabinet')[['FY22ActualExpense', 'FY23ActualExpense',
+        cabinet_years = self.df.groupby('Cabinet', observed=True)[['FY22ActualExpense', 'FY23ActualExpense',
                                                     'FY24Appropriation', 'FY25Budget']].sum()
         cabinet_years.plot(kind='bar')
         plt.title('Budget Trends by Cabinet', fontsize=14)
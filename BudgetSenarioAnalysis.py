@@ -1,12 +1,31 @@
+import matplotlib
+matplotlib.use('Agg')  # Use a non-GUI backend for rendering
+matplotlib.rcParams['figure.max_open_warning'] = 0
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 from ortools.linear_solver import pywraplp
 import mysql.connector
+from data_cache import load_table
+
+# Resolution for saved plots
+PLOT_DPI = 80
 
 
 class BudgetScenarioAnalyzer:
+    # Each scenario is its parent scenario plus the constraint adders listed here, in reporting order.
+    # Basic -> Category Limits -> Combined nest, and Key Programs forks from Basic.
+    SCENARIOS = {
+        'Basic': (None, ('add_total_budget_limit', 'add_department_limits')),
+        'Category Limits': ('Basic', ('add_category_limits',)),
+        'Key Programs': ('Basic', ('add_key_program_minimums',)),
+        'Combined': ('Category Limits', ('add_key_program_minimums',)),
+    }
+
     def __init__(self, db_config: dict):
         """Initialize with SQL database connection configuration and prepare data."""
         self.connection = mysql.connector.connect(**db_config)
@@ -14,7 +33,7 @@ class BudgetScenarioAnalyzer:
         self.prepare_data()
 
     def fetch_data(self) -> pd.DataFrame:
-        """Fetch data from the BudgetData table in the SQL database."""
+        """Fetch data from the BudgetData table, reusing the local Parquet cache when the table is unchanged."""
         query = """
         SELECT 
             Cabinet, 
@@ -27,7 +46,37 @@ class BudgetScenarioAnalyzer:
             FY25Budget 
         FROM BudgetData
         """
-        return pd.read_sql(query, self.connection)
+        return load_table(self.connection, 'BudgetData', query)
+
+    def fetch_scenario_limits(self) -> tuple:
+        """Fetch department FY23 totals and category FY23 means, aggregated by the database."""
+        dept_query = """
+        SELECT 
+            Dept, 
+            SUM(COALESCE(FY23ActualExpense, 0)) AS FY23ActualExpense 
+        FROM BudgetData
+        WHERE Dept IS NOT NULL
+        GROUP BY Dept
+        """
+        category_query = """
+        SELECT 
+            ExpenseCategory, 
+            AVG(COALESCE(FY23ActualExpense, 0)) AS FY23ActualExpense 
+        FROM BudgetData
+        WHERE ExpenseCategory IS NOT NULL
+        GROUP BY ExpenseCategory
+        """
+        dept_totals = load_table(self.connection, 'BudgetData', dept_query)
+        category_means = load_table(self.connection, 'BudgetData', category_query)
+        dept_limits = dict(zip(dept_totals['Dept'], pd.to_numeric(dept_totals['FY23ActualExpense'])))
+        cat_limits = dict(zip(category_means['ExpenseCategory'], pd.to_numeric(category_means['FY23ActualExpense'])))
+        return dept_limits, cat_limits
+
+    def __getstate__(self):
+        """Leave the database connection behind when pickling for worker processes."""
+        state = self.__dict__.copy()
+        state.pop('connection', None)
+        return state
 
     def prepare_data(self):
         """Prepare and clean the dataset."""
@@ -36,114 +85,135 @@ class BudgetScenarioAnalyzer:
         for col in budget_columns:
             self.df[col] = pd.to_numeric(self.df[col], errors='coerce').fillna(0)
         
+        # Dictionary-encode the grouping keys once
+        for col in ['Cabinet', 'Dept', 'Program', 'ExpenseCategory']:
+            self.df[col] = self.df[col].astype('category')
+
         # Extract unique programs and categories
         self.programs = self.df['Program'].unique()
         self.expense_categories = self.df['ExpenseCategory'].unique()
 
+        # Limits and lookups shared by every scenario
+        self._total_fy25_budget = self.df['FY25Budget'].sum()
+        self._dept_limits, self._cat_limits = self.fetch_scenario_limits()
+        self._by_program = {program: group for program, group in self.df.groupby('Program', observed=True, sort=False)}
+        # Each (program, category) belongs to the department of its first row
+        first_rows = self.df.drop_duplicates(['Program', 'ExpenseCategory'])
+        self._pc_to_dept = dict(zip(zip(first_rows['Program'], first_rows['ExpenseCategory']), first_rows['Dept']))
+
     def initialize_solver(self):
-        """Initialize solver and decision variables."""
+        """Initialize solver, decision variables and the total allocation objective."""
         solver = pywraplp.Solver.CreateSolver('SCIP')
-        budget_vars = {}
-        for _, row in self.df.iterrows():
-            program = row['Program']
-            expense_category = row['ExpenseCategory']
-            fy25_budget = float(row['FY25Budget'])
-            var = solver.NumVar(0, fy25_budget, f"{program}_{expense_category}")
-            budget_vars[(program, expense_category)] = var
-        return solver, budget_vars
+        programs = self.df['Program'].to_numpy()
+        categories = self.df['ExpenseCategory'].to_numpy()
+        fy25_budgets = self.df['FY25Budget'].to_numpy(dtype=np.float64)
+        budget_vars = {(program, category): solver.NumVar(0, float(fy25_budget), f"{program}_{category}")
+                       for program, category, fy25_budget in zip(programs, categories, fy25_budgets)}
 
-    def solve_scenario(self, scenario_func) -> pd.DataFrame:
-        """Solve a specific scenario and return results as DataFrame."""
-        solver, budget_vars = self.initialize_solver()
-        scenario_func(solver, budget_vars)
-        
-        if solver.Solve() == pywraplp.Solver.OPTIMAL:
-            results = []
-            for (program, category) in budget_vars:
-                results.append({
-                    'Program': program,
-                    'Expense Category': category,
-                    'Allocated Budget': budget_vars[(program, category)].solution_value()
-                })
-            return pd.DataFrame(results)
-        return pd.DataFrame()
-
-    def scenario_1(self, solver, budget_vars):
-        """Total FY25 Budget + Departmental Limits"""
         objective = solver.Objective()
         for var in budget_vars.values():
             objective.SetCoefficient(var, 1)
         objective.SetMaximization()
+        return solver, budget_vars
 
-        # Total Budget Constraint
-        total_fy25_budget = self.df['FY25Budget'].sum()
-        solver.Add(sum(budget_vars.values()) <= total_fy25_budget)
-
-        # Departmental Limits
-        department_limits = self.df.groupby('Dept')['FY23ActualExpense'].sum()
-        for dept, limit in department_limits.items():
-            dept_vars = [budget_vars[(program, category)] 
-                        for program, category in budget_vars.keys()
-                        if self.df[(self.df['Program'] == program) & 
-                                 (self.df['ExpenseCategory'] == category)]['Dept'].values[0] == dept]
+    @staticmethod
+    def _solve_current(solver, budget_vars) -> pd.DataFrame:
+        """Solve the model as it stands and return the allocations, or an empty frame."""
+        if solver.Solve() != pywraplp.Solver.OPTIMAL:
+            return pd.DataFrame()
+        return pd.DataFrame([
+            {
+                'Program': program,
+                'Expense Category': category,
+                'Allocated Budget': var.solution_value()
+            }
+            for (program, category), var in budget_vars.items()
+        ])
+
+    def add_total_budget_limit(self, solver, budget_vars) -> list:
+        """Total Budget Constraint"""
+        return [solver.Add(sum(budget_vars.values()) <= self._total_fy25_budget)]
+
+    def add_department_limits(self, solver, budget_vars) -> list:
+        """Departmental Limits"""
+        dept_to_vars = defaultdict(list)
+        for key, var in budget_vars.items():
+            dept_to_vars[self._pc_to_dept[key]].append(var)
+        constraints = []
+        for dept, limit in self._dept_limits.items():
+            dept_vars = dept_to_vars[dept]
             if dept_vars:
-                solver.Add(sum(dept_vars) <= limit)
+                constraints.append(solver.Add(sum(dept_vars) <= limit))
+        return constraints
 
-    def scenario_2(self, solver, budget_vars):
-        """Total FY25 Budget + Departmental Limits + Category Spending Limit"""
-        self.scenario_1(solver, budget_vars)
-        
-        # Category Spending Limits
-        category_limits = self.df.groupby('ExpenseCategory')['FY23ActualExpense'].mean()
-        for category, limit in category_limits.items():
+    def add_category_limits(self, solver, budget_vars) -> list:
+        """Category Spending Limits"""
+        constraints = []
+        for category, limit in self._cat_limits.items():
             category_vars = [budget_vars[(program, category)] 
                            for program in self.programs 
                            if (program, category) in budget_vars]
             if category_vars:
-                solver.Add(sum(category_vars) <= limit)
+                constraints.append(solver.Add(sum(category_vars) <= limit))
+        return constraints
 
-    def scenario_3(self, solver, budget_vars):
-        """Total FY25 Budget + Departmental Limits + Key Program Minimum Funding"""
-        self.scenario_1(solver, budget_vars)
-        
-        # Minimum Funding for Key Programs
+    def add_key_program_minimums(self, solver, budget_vars) -> list:
+        """Minimum Funding for Key Programs"""
         key_programs = ["Mayor's Administration", "Public Safety"]
         min_funding_perc = 0.5
+        constraints = []
         for program in key_programs:
-            program_data = self.df[self.df['Program'] == program]
-            for _, row in program_data .iterrows():
-                category = row['ExpenseCategory']
+            if program not in self._by_program:
+                continue
+            program_data = self._by_program[program]
+            for category, appropriation in zip(program_data['ExpenseCategory'], program_data['FY24Appropriation']):
                 if (program, category) in budget_vars:
-                    solver.Add(budget_vars[(program, category)] >= 
-                             min_funding_perc * float(row['FY24Appropriation']))
+                    constraints.append(solver.Add(budget_vars[(program, category)] >= 
+                                                  min_funding_perc * float(appropriation)))
+        return constraints
 
-    def scenario_4(self, solver, budget_vars):
-        """Combining all constraints"""
-        self.scenario_2(solver, budget_vars)
-        
-        # Add Key Program Minimum Funding
-        key_programs = ["Mayor's Administration", "Public Safety"]
-        min_funding_perc = 0.5
-        for program in key_programs:
-            program_data = self.df[self.df['Program'] == program]
-            for _, row in program_data.iterrows():
-                category = row['ExpenseCategory']
-                if (program, category) in budget_vars:
-                    solver.Add(budget_vars[(program, category)] >= 
-                             min_funding_perc * float(row['FY24Appropriation']))
+    @classmethod
+    def scenario_adders(cls, name) -> list:
+        """All constraint adders of a scenario, from its root scenario down."""
+        parent, adders = cls.SCENARIOS[name]
+        return (cls.scenario_adders(parent) if parent else []) + list(adders)
 
-    def analyze_all_scenarios(self):
-        """Run all scenarios and create visualizations."""
-        scenarios = {
-            'Basic': self.scenario_1,
-            'Category Limits': self.scenario_2,
-            'Key Programs': self.scenario_3,
-            'Combined': self.scenario_4
-        }
-        
+    @classmethod
+    def scenario_chains(cls) -> list:
+        """Split the scenarios into chains of (name, adders) steps, each solved on one model.
+
+        A scenario extends the chain ending in its parent; otherwise it starts a new chain
+        that adds all of its constraints at once.
+        """
+        chains = []
+        for name, (parent, adders) in cls.SCENARIOS.items():
+            chain = next((c for c in chains if c[-1][0] == parent), None)
+            if chain is None:
+                chains.append([(name, cls.scenario_adders(name))])
+            else:
+                chain.append((name, list(adders)))
+        return chains
+
+    def _solve_chain(self, chain) -> dict:
+        """Solve a chain of nested scenarios on one model; runs inside a worker process."""
+        solver, budget_vars = self.initialize_solver()
         results = {}
-        for name, scenario_func in scenarios.items():
-            results[name] = self.solve_scenario(scenario_func)
+        for name, adders in chain:
+            for adder in adders:
+                getattr(self, adder)(solver, budget_vars)
+            # Re-solve with the new constraints on top of the previous scenario's model
+            results[name] = self._solve_current(solver, budget_vars)
+        return results
+
+    def analyze_all_scenarios(self):
+        """Run all scenarios in parallel and create visualizations."""
+        # Independent chains run in their own processes
+        chains = self.scenario_chains()
+        chain_results = {}
+        with ProcessPoolExecutor(max_workers=len(chains)) as executor:
+            for results in executor.map(self._solve_chain, chains):
+                chain_results.update(results)
+        results = {name: chain_results[name] for name in self.SCENARIOS}
         
         self.plot_total_budget_allocation(results)
         self.plot_budget_distribution_by_category(results)
@@ -153,69 +223,57 @@ class BudgetScenarioAnalyzer:
 
     def plot_total_budget_allocation(self, results):
         """Plot total budget allocation by scenario."""
-        plt.figure(figsize=(10, 6))
+        plt.figure(figsize=(10, 6), constrained_layout=True)
         scenario_totals = {name: df['Allocated Budget'].sum() 
                           for name, df in results.items()}
         plt.bar(scenario_totals.keys(), scenario_totals.values())
         plt.title('Total Budget Allocation by Scenario')
         plt.xticks(rotation=45)
         plt.ylabel('Total Budget')
-        plt.tight_layout()
-        plt.savefig('total_budget_allocation.png')
+        plt.savefig('total_budget_allocation.png', dpi=PLOT_DPI)
         plt.close()
 
     def plot_budget_distribution_by_category(self, results):
         """Plot budget distribution by category for each scenario."""
-        plt.figure(figsize=(10, 6))
-        category_data = []
-        for scenario, df in results.items():
-            category_sums = df.groupby('Expense Category')['Allocated Budget'].sum()
-            for category, amount in category_sums.items():
-                category_data.append({
-                    'Scenario': scenario,
-                    'Category': category,
-                    'Amount': amount
-                })
-        category_df = pd.DataFrame(category_data)
+        plt.figure(figsize=(10, 6), constrained_layout=True)
+        category_df = pd.concat(
+            {scenario: df.groupby('Expense Category')['Allocated Budget'].sum()
+             for scenario, df in results.items()},
+            names=['Scenario', 'Category']
+        ).reset_index(name='Amount')
         sns.barplot(data=category_df, x='Scenario', y='Amount', hue='Category')
         plt.title('Budget Distribution by Category')
         plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.savefig('budget_distribution_by_category.png')
+        plt.savefig('budget_distribution_by_category.png', dpi=PLOT_DPI)
         plt.close()
 
     def plot_key_programs_budget_allocation(self, results):
         """Plot key programs budget allocation for each scenario."""
-        plt.figure(figsize=(10, 6))
+        plt.figure(figsize=(10, 6), constrained_layout=True)
         key_programs = ["Mayor's Administration", "Public Safety"]
-        key_program_data = []
-        for scenario, df in results.items():
-            for program in key_programs:
-                amount = df[df['Program'] == program]['Allocated Budget'].sum()
-                key_program_data.append({
-                    'Scenario': scenario,
-                    'Program': program,
-                    'Amount': amount
-                })
-        key_program_df = pd.DataFrame(key_program_data)
+        key_program_df = pd.concat(
+            {scenario: df[df['Program'].isin(key_programs)]
+                         .groupby('Program')['Allocated Budget'].sum()
+                         .reindex(key_programs, fill_value=0)
+             for scenario, df in results.items()},
+            names=['Scenario', 'Program']
+        ).reset_index(name='Amount')
         sns.barplot(data=key_program_df, x='Scenario', y='Amount', hue='Program')
         plt.title('Key Programs Budget Allocation')
         plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.savefig('key_programs_budget_allocation.png')
+        plt.savefig('key_programs_budget_allocation.png', dpi=PLOT_DPI)
         plt.close()
 
     def plot_department_distribution_heatmap(self, results):
         """Plot department distribution heatmap for scenario correlations."""
-        plt.figure(figsize=(10, 6))
+        plt.figure(figsize=(10, 6), constrained_layout=True)
         dept_scenario_matrix = pd.DataFrame()
         for scenario, df in results.items():
             dept_sums = df.groupby('Program')['Allocated Budget'].sum()
             dept_scenario_matrix[scenario] = dept_sums
         sns.heatmap(dept_scenario_matrix.corr(), annot=True, cmap='coolwarm')
         plt.title('Scenario Correlation Matrix')
-        plt.tight_layout()
-        plt.savefig('department_distribution_heatmap.png')
+        plt.savefig('department_distribution_heatmap.png', dpi=PLOT_DPI)
         plt.close()
 
 
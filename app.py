@@ -3,9 +3,12 @@ matplotlib.use('Agg')  # Use a non-GUI backend for rendering
 
 from flask import Flask, render_template, request, jsonify
 import os
+from functools import lru_cache
+import numpy as np
 import pandas as pd
+from pyarrow import csv as pacsv
 import matplotlib.pyplot as plt
-from opti import scenario_1, scenario_2, scenario_3, scenario_4, scenario_5, scenario_6
+from opti import scenario_1, scenario_2, scenario_3, scenario_4, scenario_5, scenario_6, group_sums
 
 app = Flask(__name__)
 
@@ -14,31 +17,81 @@ pd.options.display.float_format = '{:,.2f}'.format
 
 # Directory for saving plots
 PLOT_DIR = "static/plots"
+# Resolution for saved plots
+PLOT_DPI = 80
 if not os.path.exists(PLOT_DIR):
     os.makedirs(PLOT_DIR)
 
+# Scenario functions available from the web form
+SCENARIOS = {
+    "Scenario_1": scenario_1,
+    "Scenario_2": scenario_2,
+    "Scenario_3": scenario_3,
+    "Scenario_4": scenario_4,
+    "Scenario_5": scenario_5,
+    "Scenario_6": scenario_6,
+}
+
+# Scenarios already solved in this process; later requests reuse their CSVs
+solved_scenarios = set()
+
+# Plot paths for the scenario currently on disk, keyed by (scenario name, CSV mtime)
+plot_cache = {}
+
+
+@lru_cache(maxsize=32)
+def load_results(result_file, mtime):
+    """Read a scenario's results CSV; cached until the file's mtime changes."""
+    return pacsv.read_csv(result_file).to_pandas(types_mapper=pd.ArrowDtype)
+
+
+@lru_cache(maxsize=32)
+def results_html(result_file, mtime):
+    """Render a scenario's results table; cached until the file's mtime changes."""
+    return load_results(result_file, mtime).to_html(index=False, classes="table table-striped")
+
+
+def clear_plot_dir():
+    """Remove existing plots."""
+    with os.scandir(PLOT_DIR) as entries:
+        for entry in entries:
+            if entry.is_file():
+                os.unlink(entry.path)
+
+
+def cached_plots(results_df, scenario_name, mtime):
+    """Return plot paths for a scenario, redrawing only when its results changed."""
+    key = (scenario_name, mtime)
+    paths = plot_cache.get(key)
+    if paths is None or not all(os.path.isfile(path) for path in paths):
+        # Only the latest scenario's plots are kept on disk
+        clear_plot_dir()
+        plot_cache.clear()
+        paths = plot_cache[key] = plot_results(results_df, scenario_name)
+    return paths
+
+
 # Function to plot results
 def plot_results(results_df, scenario_name):
     non_zero_allocations = results_df[results_df['FY25Allocation'] > 0]
+    allocations = non_zero_allocations['FY25Allocation'].to_numpy(np.float64)
 
     # Group by Program
-    program_allocations = non_zero_allocations.groupby('Program')['FY25Allocation'].sum()
-    plt.figure(figsize=(10, 6))
+    program_allocations = group_sums(non_zero_allocations['Program'].to_numpy(), allocations)
+    plt.figure(figsize=(10, 6), constrained_layout=True)
     program_allocations.plot(kind='bar', color='cornflowerblue', title=f"{scenario_name}: FY25 Allocations by Program")
     plt.ylabel("Allocation Amount")
-    plt.tight_layout()
     program_plot_path = os.path.join(PLOT_DIR, f"{scenario_name}_program_allocations.png")
-    plt.savefig(program_plot_path)
+    plt.savefig(program_plot_path, dpi=PLOT_DPI)
     plt.close()
 
     # Group by Expense Category
-    category_allocations = non_zero_allocations.groupby('ExpenseCategory')['FY25Allocation'].sum()
-    plt.figure(figsize=(8, 8))
+    category_allocations = group_sums(non_zero_allocations['ExpenseCategory'].to_numpy(), allocations)
+    plt.figure(figsize=(8, 8), constrained_layout=True)
     category_allocations.plot(kind='pie', autopct='%1.1f%%', title=f"{scenario_name}: FY25 Allocations by Expense Category")
     plt.ylabel("")
-    plt.tight_layout()
     category_plot_path = os.path.join(PLOT_DIR, f"{scenario_name}_category_allocations.png")
-    plt.savefig(category_plot_path)
+    plt.savefig(category_plot_path, dpi=PLOT_DPI)
     plt.close()
 
     return program_plot_path, category_plot_path
@@ -85,37 +138,24 @@ def Budgetanysis():
 def run_scenario():
     scenario_name = request.form.get("scenario_name")
     try:
-        # Remove existing plots
-        for file in os.listdir(PLOT_DIR):
-            file_path = os.path.join(PLOT_DIR, file)
-            if os.path.isfile(file_path):
-                os.unlink(file_path)
-
-        # Call the appropriate scenario function
-        if scenario_name == "Scenario_1":
-            scenario_1()
-        elif scenario_name == "Scenario_2":
-            scenario_2()
-        elif scenario_name == "Scenario_3":
-            scenario_3()
-        elif scenario_name == "Scenario_4":
-            scenario_4()
-        elif scenario_name == "Scenario_5":
-            scenario_5()
-        elif scenario_name == "Scenario_6":
-            scenario_6()
-        else:
+        if scenario_name not in SCENARIOS:
             return jsonify({"error": "Invalid scenario selected"}), 400
 
+        # Solve the scenario, unless already done in this process
+        if scenario_name not in solved_scenarios:
+            SCENARIOS[scenario_name]()
+            solved_scenarios.add(scenario_name)
+
         # Load the results DataFrame
         result_file = f"optimized_budget_allocation_{scenario_name}.csv"
-        results_df = pd.read_csv(result_file)
+        mtime = os.path.getmtime(result_file)
+        results_df = load_results(result_file, mtime)
 
         # Plot results
-        program_plot_path, category_plot_path = plot_results(results_df, scenario_name)
+        program_plot_path, category_plot_path = cached_plots(results_df, scenario_name, mtime)
 
         # Generate HTML table
-        result_html = results_df.to_html(index=False, classes="table table-striped")
+        result_html = results_html(result_file, mtime)
 
         return jsonify({
             "message": f"{scenario_name} executed successfully.",
@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 
 # Load the data
 file_path = 'data/operating_budget.csv'
@@ -13,13 +14,12 @@ data[budget_columns] = data[budget_columns].replace('#Missing', pd.NA)
 # Convert to numeric, ensuring that invalid parsing results in NaN
 data[budget_columns] = data[budget_columns].apply(pd.to_numeric, errors='coerce')
 
-# Function to replace missing values with the mean of other budget columns for the same row
-def replace_with_row_mean(row):
-    row_mean = row[budget_columns].mean(skipna=True)  # Calculate mean ignoring NaN
-    return row[budget_columns].fillna(row_mean)  # Fill NaN with the row mean
-
-# Apply the function row-wise
-data[budget_columns] = data.apply(replace_with_row_mean, axis=1)
+# Replace missing values with the mean of the other budget columns for the same row
+values = data[budget_columns].to_numpy(dtype=np.float64)
+missing = np.isnan(values)
+row_means = np.nanmean(values, axis=1)  # Calculate mean ignoring NaN
+values[missing] = np.broadcast_to(row_means[:, None], values.shape)[missing]
+data[budget_columns] = values
 
 # Save the updated data back to a CSV file
 updated_file_path = 'data/mean_filled_operating_budget.csv'
@@ -0,0 +1,78 @@
+import os
+import re
+import hashlib
+import tempfile
+from functools import lru_cache
+import pandas as pd
+
+# Directory holding cached query results
+CACHE_DIR = ".cache"
+
+
+def fetch_frame(connection, query: str) -> pd.DataFrame:
+    """Run a query on an open connection and return the rows as a DataFrame."""
+    cursor = connection.cursor()
+    cursor.execute(query)
+    columns = [desc[0] for desc in cursor.description]
+    df = pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+    cursor.close()
+    return df
+
+
+def table_token(connection, table_name: str) -> str:
+    """Return a freshness token for a table: row count, highest id and content checksum.
+
+    The checksum changes on UPDATEs to existing rows, which leave the count and id unchanged.
+    """
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT COUNT(*), COALESCE(MAX(_id), 0) FROM {table_name}")
+    row_count, max_id = cursor.fetchone()
+    cursor.execute(f"CHECKSUM TABLE {table_name}")
+    _, checksum = cursor.fetchone()
+    cursor.close()
+    return f"{row_count}_{max_id}_{checksum}"
+
+
+@lru_cache(maxsize=16)
+def _read_cached(table_name: str, token: str, path: str) -> pd.DataFrame:
+    """Read a cached Parquet file once per process."""
+    return pd.read_parquet(path, engine="pyarrow")
+
+
+def _write_atomic(df: pd.DataFrame, path: str):
+    """Write Parquet to a temp file and move it into place, so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    os.close(fd)
+    try:
+        df.to_parquet(tmp_path, engine="pyarrow", index=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _remove_stale(table_name: str, query_key: str, keep: str):
+    """Delete cache files for the same table and query that were written under older tokens."""
+    pattern = re.compile(rf"{re.escape(table_name)}(_\d+)+_{query_key}\.parquet")
+    with os.scandir(CACHE_DIR) as entries:
+        for entry in entries:
+            if entry.path != keep and pattern.fullmatch(entry.name):
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    # Still open elsewhere (e.g. on Windows); a later run removes it
+                    pass
+
+
+def load_table(connection, table_name: str, query: str) -> pd.DataFrame:
+    """Load query results from the Parquet cache, querying MySQL only when the table changed."""
+    token = table_token(connection, table_name)
+    query_key = hashlib.md5(query.encode()).hexdigest()[:8]
+    path = os.path.join(CACHE_DIR, f"{table_name}_{token}_{query_key}.parquet")
+    if not os.path.exists(path):
+        df = fetch_frame(connection, query)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _write_atomic(df, path)
+        _remove_stale(table_name, query_key, keep=path)
+    # Callers modify their frame in place, so never hand out the cached object
+    return _read_cached(table_name, token, path).copy()
@@ -1,7 +1,16 @@
+import matplotlib
+matplotlib.use('Agg')  # Render plots to files only; no GUI event loop
+
+import csv
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+from numba import njit, prange
 from ortools.linear_solver import pywraplp
 import mysql.connector
 import matplotlib.pyplot as plt
+from data_cache import load_table
 
 # MySQL Database connection details
 DB_CONFIG = {
@@ -11,18 +20,26 @@ DB_CONFIG = {
     'database': 'CityBudget'
 }
 
-# Load data from MySQL database
+# Load data from MySQL database, reusing the local Parquet cache when the table is unchanged
 def fetch_data_from_mysql():
     try:
         connection = mysql.connector.connect(**DB_CONFIG)
-        query = "SELECT * FROM BudgetData"
-        operating_budget_df = pd.read_sql(query, connection)
+        query = """
+        SELECT 
+            Program, 
+            ExpenseCategory, 
+            Dept, 
+            CAST(FY25Budget AS DOUBLE) AS FY25Budget, 
+            CAST(FY24Appropriation AS DOUBLE) AS FY24Appropriation, 
+            CAST(FY23ActualExpense AS DOUBLE) AS FY23ActualExpense 
+        FROM BudgetData
+        """
+        # Numeric columns are cast by the server, so only missing values need filling;
+        # the rows come from the local Parquet cache when the table is unchanged
+        operating_budget_df = load_table(connection, 'BudgetData', query)
         connection.close()
-        
-        # Convert numeric columns
-        operating_budget_df['FY25Budget'] = pd.to_numeric(operating_budget_df['FY25Budget'], errors='coerce').fillna(0)
-        operating_budget_df['FY24Appropriation'] = pd.to_numeric(operating_budget_df['FY24Appropriation'], errors='coerce').fillna(0)
-        operating_budget_df['FY23ActualExpense'] = pd.to_numeric(operating_budget_df['FY23ActualExpense'], errors='coerce').fillna(0)
+        numeric_columns = ['FY25Budget', 'FY24Appropriation', 'FY23ActualExpense']
+        operating_budget_df[numeric_columns] = operating_budget_df[numeric_columns].astype('float64').fillna(0.0)
         return operating_budget_df
     except mysql.connector.Error as e:
         print(f"Error connecting to MySQL: {e}")
@@ -34,53 +51,146 @@ if operating_budget_df is None:
     print("Data could not be loaded. Please check your database connection.")
     exit()
 
-programs = operating_budget_df['Program'].unique()
-expense_categories = operating_budget_df['ExpenseCategory'].unique()
-
-# Function to initialize solver and decision variables
+# One decision variable per (program, category); a key's department comes from its first row
+model_df = operating_budget_df.drop_duplicates(['Program', 'ExpenseCategory']).reset_index(drop=True)
+
+# Group memberships as integer ids per model row
+dept_id, DEPT_LABELS = pd.factorize(model_df['Dept'], sort=True)
+cat_id, CATEGORY_LABELS = pd.factorize(model_df['ExpenseCategory'], sort=True)
+dept_id = dept_id.astype(np.int32)
+cat_id = cat_id.astype(np.int32)
+
+# Sort-based grouping: rows ordered by group id, with each group's segment at offsets[g]:offsets[g + 1].
+# Rows with a NULL key (id -1) are left out, so their variables stay outside every group constraint.
+def group_segments(group_id, num_groups):
+    order = np.argsort(group_id, kind='stable')
+    order = order[group_id[order] >= 0]
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(group_id[order], minlength=num_groups))])
+    return order, offsets
+
+DEPT_ORDER, DEPT_OFFSETS = group_segments(dept_id, len(DEPT_LABELS))
+CATEGORY_ORDER, CATEGORY_OFFSETS = group_segments(cat_id, len(CATEGORY_LABELS))
+
+# Department limits aligned with the group ids; the data does not change between scenarios
+DEPT_LIMITS = operating_budget_df.groupby('Dept')['FY24Appropriation'].sum().reindex(DEPT_LABELS).to_numpy()
+TOTAL_FY25 = float(operating_budget_df['FY25Budget'].sum())
+FY25_BOUNDS = model_df['FY25Budget'].to_numpy(np.float64)
+
+# Bound tightening for one family of group caps: no variable can exceed its group's cap, and a
+# group whose FY25 bounds already sum to at most its cap cannot bind, so its constraint is redundant.
+# Rows without a group (id -1) belong to no cap and keep their FY25 bound.
+@njit(parallel=True, cache=True)
+def _tighten_bounds(fy25, group_id, cap_by_group):
+    group_bound = np.zeros(cap_by_group.size)
+    for i in range(fy25.size):
+        if group_id[i] >= 0:
+            group_bound[group_id[i]] += fy25[i]
+    tight = np.empty_like(fy25)
+    for i in prange(fy25.size):
+        if group_id[i] >= 0:
+            tight[i] = min(fy25[i], max(cap_by_group[group_id[i]], 0.0))
+        else:
+            tight[i] = fy25[i]
+    return tight, group_bound > cap_by_group
+
+# Function to initialize solver, decision variables and objective
 def initialize_solver():
-    solver = pywraplp.Solver.CreateSolver('SCIP')
-    budget_vars = {}
-    for _, row in operating_budget_df.iterrows():
-        program = row['Program']
-        expense_category = row['ExpenseCategory']
-        fy25_budget = float(row['FY25Budget'])
-        var = solver.NumVar(0, fy25_budget, f"{program}_{expense_category}")
-        budget_vars[(program, expense_category)] = var
-    return solver, budget_vars
-
-# Function to solve and save results
-def solve_and_save(solver, budget_vars, scenario_name):
-    status = solver.Solve()
-    if status == pywraplp.Solver.OPTIMAL:
-        results = [(program, category, budget_vars[(program, category)].solution_value())
-                   for (program, category) in budget_vars]
-        results_df = pd.DataFrame(results, columns=['Program', 'ExpenseCategory', 'FY25Allocation'])
-        results_df.to_csv(f"optimized_budget_allocation_{scenario_name}.csv", index=False)
-        print(f"Optimization successful. Results saved to 'optimized_budget_allocation_{scenario_name}.csv'.")
-        plot_results(results_df, scenario_name)
-    else:
-        print(f"No optimal solution found for {scenario_name}. Check constraints.")
+    solver = pywraplp.Solver.CreateSolver('GLOP')
+    columns = model_df[['Program', 'ExpenseCategory', 'FY25Budget']]
+    vars_by_row = [solver.NumVar(0, fy25_budget, f"{program}_{expense_category}")
+                   for program, expense_category, fy25_budget in columns.itertuples(index=False, name=None)]
+
+    # Objective: maximize total allocation
+    solver.Maximize(solver.Sum(vars_by_row))
+    return solver, vars_by_row
+
+# Shared model; each scenario adds its constraints, solves and removes them again
+solver, vars_by_row = initialize_solver()
+# Expression shared by every scenario's total budget constraint
+total_allocation = solver.Sum(vars_by_row)
+# Variables laid out contiguously by department and by category, so each group is a slice
+vars_by_dept = [vars_by_row[i] for i in DEPT_ORDER]
+vars_by_category = [vars_by_row[i] for i in CATEGORY_ORDER]
+solver_lock = threading.Lock()
+
+# Deactivate constraints; pywraplp cannot delete them, so empty them and free their bounds
+def remove_constraints(solver, constraints):
+    for constraint in constraints:
+        constraint.Clear()
+        constraint.SetBounds(-solver.infinity(), solver.infinity())
+
+# Function to add group caps: tighten the variable bounds, then constrain only the groups that can bind
+def add_group_caps(solver, vars_by_row, grouped_vars, offsets, group_id, caps):
+    tight_bounds, binding = _tighten_bounds(FY25_BOUNDS, group_id, caps)
+    for var, bound in zip(vars_by_row, tight_bounds):
+        var.SetUb(bound)
+    return [solver.Add(solver.Sum(grouped_vars[offsets[g]:offsets[g + 1]]) <= caps[g]) for g in np.flatnonzero(binding)]
+
+# Restore the FY25 upper bounds after a scenario tightened them
+def reset_bounds(vars_by_row):
+    for var, bound in zip(vars_by_row, FY25_BOUNDS):
+        var.SetUb(bound)
+
+# Function to solve and save results, then drop the scenario's constraints and bounds
+def solve_and_save(solver, vars_by_row, scenario_name, constraints):
+    try:
+        status = solver.Solve()
+        if status == pywraplp.Solver.OPTIMAL:
+            allocations = np.fromiter((var.solution_value() for var in vars_by_row),
+                                      dtype=np.float64, count=len(vars_by_row))
+            result_file = f"optimized_budget_allocation_{scenario_name}.csv"
+            with open(result_file, 'w', newline='') as f:
+                writer = csv.writer(f, lineterminator='\n')
+                writer.writerow(['Program', 'ExpenseCategory', 'FY25Allocation'])
+                # Missing keys are written as empty fields, as DataFrame.to_csv does
+                writer.writerows(zip(model_df['Program'].fillna(''), model_df['ExpenseCategory'].fillna(''),
+                                     (f"{allocation:.2f}" for allocation in allocations)))
+            print(f"Optimization successful. Results saved to '{result_file}'.")
+
+            # Only non-zero allocations are plotted
+            non_zero = allocations > 0
+            plot_results(pd.DataFrame({
+                'Program': model_df['Program'].to_numpy()[non_zero],
+                'ExpenseCategory': model_df['ExpenseCategory'].to_numpy()[non_zero],
+                'FY25Allocation': allocations[non_zero],
+            }), scenario_name)
+        else:
+            print(f"No optimal solution found for {scenario_name}. Check constraints.")
+    finally:
+        remove_constraints(solver, constraints)
+        reset_bounds(vars_by_row)
+
+# Sort-based group-by: sum values per key with np.unique + np.add.reduceat, keys in sorted order.
+# Missing keys are dropped first, as groupby().sum() does.
+def group_sums(keys, values):
+    present = ~pd.isna(keys)
+    keys, values = keys[present], values[present]
+    order = np.argsort(keys, kind='stable')
+    labels, first = np.unique(keys[order], return_index=True)
+    return pd.Series(np.add.reduceat(values[order], first), index=labels)
 
 # Function to plot results
 def plot_results(results_df, scenario_name):
     non_zero_allocations = results_df[results_df['FY25Allocation'] > 0]
+    allocations = non_zero_allocations['FY25Allocation'].to_numpy(np.float64)
 
     # Group by Program
-    program_allocations = non_zero_allocations.groupby('Program')['FY25Allocation'].sum()
-    program_allocations.plot(kind='bar', figsize=(10, 6), title=f"{scenario_name}: FY25 Allocations by Program", color='cornflowerblue')
-    plt.ylabel("Allocation Amount")
-    plt.tight_layout()
-    plt.savefig(f"{scenario_name}_program_allocations.png")
-    plt.show()
+    program_allocations = group_sums(non_zero_allocations['Program'].to_numpy(), allocations)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    program_allocations.plot(kind='bar', ax=ax, title=f"{scenario_name}: FY25 Allocations by Program", color='cornflowerblue')
+    ax.set_ylabel("Allocation Amount")
+    fig.tight_layout()
+    fig.savefig(f"{scenario_name}_program_allocations.png")
+    plt.close(fig)
 
     # Group by Expense Category
-    category_allocations = non_zero_allocations.groupby('ExpenseCategory')['FY25Allocation'].sum()
-    category_allocations.plot(kind='pie', figsize=(8, 8), title=f"{scenario_name}: FY25 Allocations by Expense Category", autopct='%1.1f%%')
-    plt.ylabel("")
-    plt.tight_layout()
-    plt.savefig(f"{scenario_name}_category_allocations.png")
-    plt.show()
+    category_allocations = group_sums(non_zero_allocations['ExpenseCategory'].to_numpy(), allocations)
+    fig, ax = plt.subplots(figsize=(8, 8))
+    category_allocations.plot(kind='pie', ax=ax, title=f"{scenario_name}: FY25 Allocations by Expense Category", autopct='%1.1f%%')
+    ax.set_ylabel("")
+    fig.tight_layout()
+    fig.savefig(f"{scenario_name}_category_allocations.png")
+    plt.close(fig)
 
 # # Define each scenario
 # def scenario_1():
@@ -119,122 +229,83 @@ def plot_results(results_df, scenario_name):
 # Define each scenario
 
 def scenario_1():
-    solver, budget_vars = initialize_solver()
-    objective = solver.Objective()
-    for var in budget_vars.values():
-        objective.SetCoefficient(var, 1)
-    objective.SetMaximization()
-
-    # Constraints
-    total_fy25_budget = operating_budget_df['FY25Budget'].sum()
-    solver.Add(sum(budget_vars[(program, category)] for (program, category) in budget_vars) <= total_fy25_budget)
+    with solver_lock:
+        # Constraints
+        constraints = [solver.Add(total_allocation <= TOTAL_FY25)]
 
-    solve_and_save(solver, budget_vars, "Scenario_1")
+        solve_and_save(solver, vars_by_row, "Scenario_1", constraints)
 
 
 def scenario_2():
-    solver, budget_vars = initialize_solver()
-    objective = solver.Objective()
-    for var in budget_vars.values():
-        objective.SetCoefficient(var, 1)
-    objective.SetMaximization()
+    with solver_lock:
+        # Constraints
+        constraints = [solver.Add(total_allocation <= TOTAL_FY25)]
 
-    # Constraints
-    solver.Add(sum(budget_vars[(program, category)] for (program, category) in budget_vars) <= 
-               operating_budget_df['FY25Budget'].sum())
+        # Ensure no department exceeds 110% of its FY24 Appropriation
+        constraints += add_group_caps(solver, vars_by_row, vars_by_dept, DEPT_OFFSETS, dept_id, 1.1 * DEPT_LIMITS)
 
-    # Ensure no department exceeds 110% of its FY24 Appropriation
-    dept_limits = operating_budget_df.groupby('Dept')['FY24Appropriation'].sum().to_dict()
-    for dept, appropriation in dept_limits.items():
-        solver.Add(sum(budget_vars[(program, category)] for (program, category) in budget_vars 
-                       if operating_budget_df[(operating_budget_df['Program'] == program) & 
-                                              (operating_budget_df['ExpenseCategory'] == category)]['Dept'].values[0] == dept) <= 1.1 * appropriation)
-
-    solve_and_save(solver, budget_vars, "Scenario_2")
+        solve_and_save(solver, vars_by_row, "Scenario_2", constraints)
 
 
 def scenario_3():
-    solver, budget_vars = initialize_solver()
-    objective = solver.Objective()
-    for var in budget_vars.values():
-        objective.SetCoefficient(var, 1)
-    objective.SetMaximization()
-
-    # Constraints
-    total_fy25_budget = operating_budget_df['FY25Budget'].sum()
-    solver.Add(sum(budget_vars[(program, category)] for (program, category) in budget_vars) <= total_fy25_budget)
+    with solver_lock:
+        # Constraints
+        constraints = [solver.Add(total_allocation <= TOTAL_FY25)]
 
-    # Ensure that no expense category exceeds 10% of the total FY25 budget
-    category_limits = operating_budget_df.groupby('ExpenseCategory')['FY25Budget'].sum().to_dict()
-    for category, category_budget in category_limits.items():
-        solver.Add(sum(budget_vars[(program, category)] for (program, category) in budget_vars if category == category) <= 0.1 * total_fy25_budget)
+        # Ensure that no expense category exceeds 10% of the total FY25 budget
+        category_caps = np.full(len(CATEGORY_LABELS), 0.1 * TOTAL_FY25)
+        constraints += add_group_caps(solver, vars_by_row, vars_by_category, CATEGORY_OFFSETS, cat_id, category_caps)
 
-    solve_and_save(solver, budget_vars, "Scenario_3")
+        solve_and_save(solver, vars_by_row, "Scenario_3", constraints)
 
 
 def scenario_4():
-    solver, budget_vars = initialize_solver()
-    objective = solver.Objective()
-    for var in budget_vars.values():
-        objective.SetCoefficient(var, 1)
-    objective.SetMaximization()
+    with solver_lock:
+        # Constraints
+        constraints = [solver.Add(total_allocation <= TOTAL_FY25)]
 
-    # Constraints
-    total_fy25_budget = operating_budget_df['FY25Budget'].sum()
-    solver.Add(sum(budget_vars[(program, category)] for (program, category) in budget_vars) <= total_fy25_budget)
+        # Max allocation for each department based on their FY24 appropriation
+        constraints += add_group_caps(solver, vars_by_row, vars_by_dept, DEPT_OFFSETS, dept_id, DEPT_LIMITS)
 
-    # Max allocation for each department based on their FY24 appropriation
-    dept_limits = operating_budget_df.groupby('Dept')['FY24Appropriation'].sum().to_dict()
-    for dept, appropriation in dept_limits.items():
-        solver.Add(sum(budget_vars[(program, category)] for (program, category) in budget_vars 
-                       if operating_budget_df[(operating_budget_df['Program'] == program) & 
-                                              (operating_budget_df['ExpenseCategory'] == category)]['Dept'].values[0] == dept) <= appropriation)
-
-    solve_and_save(solver, budget_vars, "Scenario_4")
+        solve_and_save(solver, vars_by_row, "Scenario_4", constraints)
 
 
 def scenario_5():
-    solver, budget_vars = initialize_solver()
-    objective = solver.Objective()
-    for var in budget_vars.values():
-        objective.SetCoefficient(var, 1)
-    objective.SetMaximization()
-
-    # Constraints
-    total_fy25_budget = operating_budget_df['FY25Budget'].sum()
-    solver.Add(sum(budget_vars[(program, category)] for (program, category) in budget_vars) <= total_fy25_budget)
+    with solver_lock:
+        # Constraints
+        constraints = [solver.Add(total_allocation <= TOTAL_FY25)]
 
-    # Max allocation for each department based on their FY24 appropriation, with additional 5% flexibility
-    dept_limits = operating_budget_df.groupby('Dept')['FY24Appropriation'].sum().to_dict()
-    for dept, appropriation in dept_limits.items():
-        solver.Add(sum(budget_vars[(program, category)] for (program, category) in budget_vars 
-                       if operating_budget_df[(operating_budget_df['Program'] == program) & 
-                                              (operating_budget_df['ExpenseCategory'] == category)]['Dept'].values[0] == dept) <= 1.05 * appropriation)
+        # Max allocation for each department based on their FY24 appropriation, with additional 5% flexibility
+        constraints += add_group_caps(solver, vars_by_row, vars_by_dept, DEPT_OFFSETS, dept_id, 1.05 * DEPT_LIMITS)
 
-    solve_and_save(solver, budget_vars, "Scenario_5")
+        solve_and_save(solver, vars_by_row, "Scenario_5", constraints)
 
 
 def scenario_6():
-    solver, budget_vars = initialize_solver()
-    objective = solver.Objective()
-    for var in budget_vars.values():
-        objective.SetCoefficient(var, 1)
-    objective.SetMaximization()
-
-    # Constraints
-    total_fy25_budget = operating_budget_df['FY25Budget'].sum()
-    solver.Add(sum(budget_vars[(program, category)] for (program, category) in budget_vars) <= total_fy25_budget)
-
-    # Limit total allocation per expense category to 30% of the overall FY25 budget
-    category_limits = operating_budget_df.groupby('ExpenseCategory')['FY25Budget'].sum().to_dict()
-    for category, category_budget in category_limits.items():
-        solver.Add(sum(budget_vars[(program, category)] for (program, category) in budget_vars if category == category) <= 0.3 * total_fy25_budget)
-
-    solve_and_save(solver, budget_vars, "Scenario_6")
-
-# scenario_1()
-# scenario_2()
-# scenario_3()
-# scenario_4()
-# scenario_5()
-# scenario_6()
+    with solver_lock:
+        # Constraints
+        constraints = [solver.Add(total_allocation <= TOTAL_FY25)]
+
+        # Limit total allocation per expense category to 30% of the overall FY25 budget
+        category_caps = np.full(len(CATEGORY_LABELS), 0.3 * TOTAL_FY25)
+        constraints += add_group_caps(solver, vars_by_row, vars_by_category, CATEGORY_OFFSETS, cat_id, category_caps)
+
+        solve_and_save(solver, vars_by_row, "Scenario_6", constraints)
+
+
+# Scenarios are independent solves on read-only data
+SCENARIOS = (scenario_1, scenario_2, scenario_3, scenario_4, scenario_5, scenario_6)
+
+# Function to run every scenario in parallel. Workers inherit the loaded data and model only under
+# the fork start method (Linux). Where workers are spawned (Windows, macOS), each one re-imports this
+# module, repeating the fetch and model build, and exits at import if the database is unreachable.
+def run_all_scenarios():
+    with ProcessPoolExecutor(max_workers=len(SCENARIOS)) as executor:
+        futures = [executor.submit(scenario) for scenario in SCENARIOS]
+        # Re-raise any worker's exception here
+        for future in futures:
+            future.result()
+
+
+if __name__ == '__main__':
+    run_all_scenarios()